@@ -1,18 +1,26 @@
 # main.py
 import os
 import uuid
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+import asyncio
+import functools
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse
 import shutil
 from typing import Dict, Any
 
-from video_processor import VideoProcessor
+import worker_tasks
+from video_processor import default_frame_skip, split_frame_ranges, build_analysis_result
 from models import *
 from temp_storage import temp_storage
 
-app = FastAPI(title="Video Face Blurring API", version="1.0.0")
+app = FastAPI(title="Video Face Blurring API", version="1.0.0",
+              default_response_class=ORJSONResponse)
 
 # Настройка CORS для фронтенда
 app.add_middleware(
@@ -26,8 +34,123 @@ app.add_middleware(
 # Монтируем статические файлы для фронтенда
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Глобальные переменные
-processor = VideoProcessor()
+# Период запуска очистки временных файлов (секунды)
+JANITOR_INTERVAL_SECONDS = 3600
+# Размер блока при отдаче видеофайлов
+FILE_RESPONSE_CHUNK_SIZE = 1 << 20
+# Количество одновременно выполняемых задач анализа/обработки
+JOB_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+# Сколько задач может ждать в очереди; сверх этого сервер отвечает 503
+JOB_QUEUE_SIZE = 32
+# На сколько диапазонов кадров делится анализ одного видео
+ANALYSIS_RANGES = os.cpu_count() or 1
+# Вести лица трекером KCF между кадрами детектора (маски для каждого кадра)
+FACE_TRACKING = os.environ.get("FACE_TRACKING") == "1"
+# Пикселизация на GPU (нужен OpenCV с CUDA) - в одном процессе пула
+CUDA_PIXELATION = os.environ.get("CUDA_PIXELATION") == "1"
+
+async def _janitor():
+    """Периодически удаляет устаревшие сессии и временные файлы"""
+    while True:
+        try:
+            await temp_storage.cleanup_old_files()
+        except Exception as e:
+            print(f"💥 Cleanup error: {str(e)}")
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+
+@app.on_event("startup")
+async def start_janitor():
+    """Запускает фоновую очистку временных файлов"""
+    app.state.janitor_task = asyncio.create_task(_janitor())
+
+async def _job_worker(queue: asyncio.Queue):
+    """Забирает задачи из очереди и выполняет их по одной"""
+    while True:
+        kind, *args = await queue.get()
+        try:
+            await JOB_HANDLERS[kind](*args)
+        except Exception as e:
+            print(f"💥 Job {kind} error: {str(e)}")
+        finally:
+            queue.task_done()
+
+async def _drain_progress(progress_queue):
+    """Переносит прогресс обработки из процессов пула в хранилище сессий"""
+    loop = asyncio.get_running_loop()
+    while True:
+        video_id, percent = await loop.run_in_executor(None, progress_queue.get)
+        
+        # Запоздавшие сообщения не должны перезаписывать итоговый статус
+        session_info = temp_storage.get_session_info(video_id)
+        if not session_info or session_info['status'] != ProcessingStatus.PROCESSING:
+            continue
+        
+        progress = 50 + (percent * 0.5)  # От 50% до 100%
+        temp_storage.update_session_status(video_id, ProcessingStatus.PROCESSING, f"Processing... {percent:.1f}%", progress)
+
+@app.on_event("startup")
+async def start_job_workers():
+    """Создает пул процессов, очередь задач и ограниченный пул обработчиков"""
+    # CPU-нагрузка (OpenCV/dlib) выполняется в отдельных процессах, минуя GIL
+    pool_workers = os.cpu_count() or 1
+    app.state.pool = ProcessPoolExecutor(max_workers=pool_workers, initializer=worker_tasks.init_worker,
+                                         initargs=(multiprocessing.Value('b', CUDA_PIXELATION),))
+    # Пул запускает процессы по требованию - запускаем их сразу, чтобы создание
+    # и прогрев детекторов не попадали в первую задачу
+    for _ in range(pool_workers):
+        app.state.pool.submit(worker_tasks.start_worker)
+    app.state.progress_manager = multiprocessing.Manager()
+    app.state.progress_queue = app.state.progress_manager.Queue()
+    app.state.progress_task = asyncio.create_task(_drain_progress(app.state.progress_queue))
+    
+    app.state.job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    app.state.job_workers = [
+        asyncio.create_task(_job_worker(app.state.job_queue))
+        for _ in range(JOB_WORKERS)
+    ]
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    """Останавливает обработчики и пул процессов"""
+    for task in [*app.state.job_workers, app.state.progress_task]:
+        task.cancel()
+    app.state.pool.shutdown(wait=False, cancel_futures=True)
+    app.state.progress_manager.shutdown()
+
+def _probe_video(video_path: str) -> Dict[str, Any]:
+    """Читает метаданные видео (выполняется в пуле потоков)"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    
+    return {
+        "fps": fps,
+        "total_frames": total_frames,
+        "duration": total_frames / fps if fps > 0 else 0,
+        "width": width,
+        "height": height
+    }
+
+def _enqueue_job(job: tuple):
+    """Ставит задачу в очередь; если очередь заполнена - 503, статус сессии не меняется"""
+    try:
+        app.state.job_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Server is busy, try again later")
+
+def _video_file_response(path: str, filename: str) -> FileResponse:
+    """Отдает видеофайл как есть: stat заранее, крупные блоки, без сжатия"""
+    # GZipMiddleware намеренно не подключается - сжатие заставило бы буферизовать
+    # файл и лишило бы сервер возможности отдать его через pathsend/sendfile
+    response = FileResponse(path, filename=filename, stat_result=os.stat(path),
+                            media_type="video/mp4")
+    response.chunk_size = FILE_RESPONSE_CHUNK_SIZE
+    return response
 
 @app.post("/api/upload", response_model=VideoUploadResponse)
 async def upload_video(file: UploadFile = File(...)):
@@ -43,28 +166,13 @@ async def upload_video(file: UploadFile = File(...)):
         # Создаем сессию
         temp_storage.create_session(video_id, file.filename)
         
-        # Читаем и сохраняем файл
-        content = await file.read()
-        video_path = temp_storage.save_uploaded_file(video_id, content)
+        # Потоково сохраняем файл на диск
+        video_path = await temp_storage.save_uploaded_file_stream(video_id, file)
         
-        # Получаем информацию о видео
-        import cv2
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = total_frames / fps if fps > 0 else 0
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        cap.release()
-        
-        video_info = {
-            "filename": file.filename,
-            "fps": fps,
-            "total_frames": total_frames,
-            "duration": duration,
-            "width": width,
-            "height": height
-        }
+        # Получаем информацию о видео вне event loop
+        loop = asyncio.get_running_loop()
+        probe = await loop.run_in_executor(None, _probe_video, video_path)
+        video_info = {"filename": file.filename, **probe}
         
         return VideoUploadResponse(
             video_id=video_id,
@@ -77,21 +185,23 @@ async def upload_video(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Upload error: {str(e)}")
 
 @app.post("/api/analyze/{video_id}")
-async def analyze_video(video_id: str, background_tasks: BackgroundTasks):
+async def analyze_video(video_id: str):
     """Запускает анализ видео в фоне"""
     try:
         video_path = temp_storage.get_video_path(video_id)
         if not video_path:
             raise HTTPException(status_code=404, detail="Video not found")
         
-        # Обновляем статус
-        temp_storage.update_session_status(video_id, ProcessingStatus.ANALYZING, "Analyzing video...", 10)
+        # Ставим анализ в очередь фоновых задач
+        _enqueue_job(("analyze", video_id, video_path))
         
-        # Запускаем анализ в фоне
-        background_tasks.add_task(perform_analysis, video_id, video_path)
+        # Обновляем статус (воркер возьмет задачу не раньше следующего await)
+        temp_storage.update_session_status(video_id, ProcessingStatus.ANALYZING, "Analyzing video...", 10)
         
         return {"status": "analysis_started", "message": "Video analysis started"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         temp_storage.update_session_status(video_id, ProcessingStatus.ERROR, f"Analysis error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Analysis error: {str(e)}")
@@ -122,34 +232,30 @@ async def generate_preview(video_id: str, request: PreviewRequest):
         
         print(f"🔍 [DEBUG] Video path: {video_path}")
         print(f"🔍 [DEBUG] Masks data type: {type(request.masks)}")
-        print(f"🔍 [DEBUG] First mask sample: {list(request.masks.items())[0] if request.masks else 'No masks'}")
-        
-        # Преобразуем Pydantic модели в обычные словари
-        masks_dict = {}
-        for frame_key, face_boxes in request.masks.items():
-            masks_dict[str(frame_key)] = [
-                {
-                    'x': face.x,
-                    'y': face.y, 
-                    'width': face.width,
-                    'height': face.height,
-                    'confidence': face.confidence
-                }
-                for face in face_boxes
-            ]
-        
-        print(f"🔍 [DEBUG] Converted masks keys: {list(masks_dict.keys())[:3]}")  # Первые 3 ключа
+        print(f"🔍 [DEBUG] First mask sample: {next(iter(request.masks.items()), 'No masks')}")
+        
+        # Маски приходят обычными словарями и передаются в процессор без преобразования
+        masks_dict = request.masks
+        
+        print(f"🔍 [DEBUG] Converted masks keys: {list(itertools.islice(masks_dict, 3))}")  # Первые 3 ключа без копирования всех
 
+        # Шаг анализа нужен, чтобы применить маски и к пропущенным кадрам
+        analysis_result = temp_storage.get_analysis_result(video_id)
+        frame_skip = analysis_result['analysis_settings'].get('frame_skip', 1) if analysis_result else 1
+        
         # Генерируем превью
-        preview_path = os.path.join(temp_storage.get_session_dir(video_id), "preview.mp4")
+        preview_path = temp_storage.get_target_path(video_id, 'preview_video')
 
-        success = processor.generate_preview(
+        loop = asyncio.get_running_loop()
+        success = await loop.run_in_executor(app.state.pool, functools.partial(
+            worker_tasks.run_preview,
             input_path=video_path,
             output_path=preview_path,
             masks_data=masks_dict,  # Используем преобразованные данные
             blur_strength=request.blur_strength,
-            preview_duration=request.preview_duration
-        )
+            preview_duration=request.preview_duration,
+            frame_skip=frame_skip
+        ))
         
         if success:
             temp_storage.save_preview_video(video_id, preview_path)
@@ -164,34 +270,25 @@ async def generate_preview(video_id: str, request: PreviewRequest):
         raise HTTPException(status_code=500, detail=f"Preview error: {str(e)}")
 
 @app.post("/api/process/{video_id}")
-async def process_video(video_id: str, request: ProcessRequest, background_tasks: BackgroundTasks):
+async def process_video(video_id: str, request: ProcessRequest):
     """Запускает обработку видео в фоне"""
     try:
         video_path = temp_storage.get_video_path(video_id)
         if not video_path:
             raise HTTPException(status_code=404, detail="Video not found")
         
-        temp_storage.update_session_status(video_id, ProcessingStatus.PROCESSING, "Processing video...", 50)
+        # Маски приходят обычными словарями и передаются в процессор без преобразования
+        masks_dict = request.masks
+        
+        # Ставим обработку в очередь фоновых задач
+        _enqueue_job(("process", video_id, video_path, masks_dict, request.blur_strength))
         
-        # Преобразуем Pydantic модели в обычные словари
-        masks_dict = {}
-        for frame_key, face_boxes in request.masks.items():
-            masks_dict[str(frame_key)] = [
-                {
-                    'x': face.x,
-                    'y': face.y, 
-                    'width': face.width,
-                    'height': face.height,
-                    'confidence': face.confidence
-                }
-                for face in face_boxes
-            ]
-        
-        # Запускаем обработку в фоне
-        background_tasks.add_task(perform_processing, video_id, video_path, masks_dict, request.blur_strength)
+        temp_storage.update_session_status(video_id, ProcessingStatus.PROCESSING, "Processing video...", 50)
         
         return {"status": "processing_started", "message": "Video processing started"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         temp_storage.update_session_status(video_id, ProcessingStatus.ERROR, f"Processing error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
@@ -230,8 +327,9 @@ async def download_video(video_id: str):
     if not output_path or not os.path.exists(output_path):
         raise HTTPException(status_code=404, detail="Processed video not found")
     
-    filename = f"blurred_{temp_storage.sessions[video_id]['original_filename']}"
-    return FileResponse(output_path, filename=filename)
+    session_info = temp_storage.get_session_info(video_id)
+    filename = f"blurred_{session_info['original_filename']}"
+    return _video_file_response(output_path, filename)
 
 @app.get("/api/preview-file/{video_id}")
 async def get_preview_video(video_id: str):
@@ -240,7 +338,7 @@ async def get_preview_video(video_id: str):
     if not preview_path or not os.path.exists(preview_path):
         raise HTTPException(status_code=404, detail="Preview not found")
     
-    return FileResponse(preview_path, filename="preview.mp4")
+    return _video_file_response(preview_path, "preview.mp4")
 
 # Фоновые задачи
 async def perform_analysis(video_id: str, video_path: str):
@@ -248,8 +346,26 @@ async def perform_analysis(video_id: str, video_path: str):
     try:
         temp_storage.update_session_status(video_id, ProcessingStatus.ANALYZING, "Detecting faces...", 30)
         
-        # Анализируем видео
-        analysis_result = processor.analyze_video(video_path)
+        loop = asyncio.get_running_loop()
+        video_info = await loop.run_in_executor(None, _probe_video, video_path)
+        frame_skip = default_frame_skip(video_info['fps'])
+        
+        # Детектор dlib однопоточный: делим видео на диапазоны кадров и анализируем
+        # их параллельно в пуле процессов (у каждого процесса свой детектор)
+        ranges = split_frame_ranges(video_info['total_frames'], ANALYSIS_RANGES, frame_skip)
+        parts = await asyncio.gather(*(
+            loop.run_in_executor(app.state.pool, worker_tasks.run_analysis_range,
+                                 video_path, start, stop, frame_skip, FACE_TRACKING)
+            for start, stop in ranges
+        ))
+        
+        faces_by_frame = {}
+        for part in parts:
+            faces_by_frame.update(part)
+        
+        # С трекером маски есть для каждого кадра - удерживать их не нужно
+        analysis_result = build_analysis_result({'file_path': video_path, **video_info},
+                                                faces_by_frame, 1 if FACE_TRACKING else frame_skip)
         
         # Сохраняем результаты
         temp_storage.save_analysis_result(video_id, analysis_result)
@@ -267,19 +383,20 @@ async def perform_processing(video_id: str, video_path: str, masks_data: Dict, b
             raise Exception("Analysis results not found")
         
         # Обрабатываем видео
-        output_path = os.path.join(temp_storage.get_session_dir(video_id), "processed_video.mp4")
-        
-        def progress_callback(percent):
-            progress = 50 + (percent * 0.5)  # От 50% до 100%
-            temp_storage.update_session_status(video_id, ProcessingStatus.PROCESSING, f"Processing... {percent:.1f}%", progress)
+        output_path = temp_storage.get_target_path(video_id, 'output_video')
         
-        success = processor.process_video(
+        # Прогресс возвращается через progress_queue и обрабатывается _drain_progress
+        loop = asyncio.get_running_loop()
+        success = await loop.run_in_executor(app.state.pool, functools.partial(
+            worker_tasks.run_processing,
+            video_id,
+            app.state.progress_queue,
             input_path=video_path,
             output_path=output_path,
             masks_data=masks_data,  # Используем уже преобразованные данные
             blur_strength=blur_strength,
-            progress_callback=progress_callback
-        )
+            frame_skip=analysis_result['analysis_settings'].get('frame_skip', 1)
+        ))
         
         if success:
             temp_storage.save_output_video(video_id, output_path)
@@ -290,6 +407,12 @@ async def perform_processing(video_id: str, video_path: str, masks_data: Dict, b
     except Exception as e:
         temp_storage.update_session_status(video_id, ProcessingStatus.ERROR, f"Processing failed: {str(e)}")
 
+# Обработчики задач из очереди
+JOB_HANDLERS = {
+    "analyze": perform_analysis,
+    "process": perform_processing,
+}
+
 @app.get("/")
 async def root():
     """Перенаправляет на фронтенд"""
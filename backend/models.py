@@ -1,5 +1,5 @@
 # models.py - ОБНОВЛЕННАЯ ВЕРСИЯ
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from typing import List, Dict, Optional, Any
 from enum import Enum
 
@@ -19,6 +19,22 @@ class FaceBoundingBox(BaseModel):
     height: int = Field(..., description="Высота прямоугольника")
     confidence: float = Field(1.0, description="Уверенность детекции")
 
+# Обязательные ключи маски, передаваемой в запросах превью/обработки
+MASK_REQUIRED_KEYS = frozenset(('x', 'y', 'width', 'height'))
+
+def validate_masks(masks: Dict[str, List[Dict[str, Any]]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Облегченная проверка масок: номера кадров и обязательные числовые ключи, без создания моделей"""
+    for frame_key, face_boxes in masks.items():
+        if not (frame_key.isascii() and frame_key.isdigit()):
+            raise ValueError(f"Mask frame key must be a frame number, got: {frame_key!r}")
+        for face in face_boxes:
+            if not MASK_REQUIRED_KEYS <= face.keys():
+                missing = ', '.join(sorted(MASK_REQUIRED_KEYS - face.keys()))
+                raise ValueError(f"Mask in frame {frame_key} is missing keys: {missing}")
+            if not all(isinstance(face[key], (int, float)) for key in MASK_REQUIRED_KEYS):
+                raise ValueError(f"Mask in frame {frame_key} has non-numeric coordinates")
+    return masks
+
 class VideoUploadResponse(BaseModel):
     """Ответ на загрузку видео"""
     video_id: str = Field(..., description="Уникальный идентификатор видео")
@@ -34,15 +50,25 @@ class AnalysisResult(BaseModel):
 
 class PreviewRequest(BaseModel):
     """Запрос на генерацию превью"""
-    masks: Dict[str, List[FaceBoundingBox]] = Field(..., description="Маски для размытия")
+    masks: Dict[str, List[Dict[str, Any]]] = Field(..., description="Маски для размытия")
     blur_strength: int = Field(15, ge=1, le=50, description="Сила размытия (1-50)")
     preview_duration: int = Field(10, ge=5, le=30, description="Длительность превью в секундах")
 
+    @field_validator('masks')
+    @classmethod
+    def check_masks(cls, masks):
+        return validate_masks(masks)
+
 class ProcessRequest(BaseModel):
     """Запрос на обработку видео"""
-    masks: Dict[str, List[FaceBoundingBox]] = Field(..., description="Маски для размытия")
+    masks: Dict[str, List[Dict[str, Any]]] = Field(..., description="Маски для размытия")
     blur_strength: int = Field(15, ge=1, le=50, description="Сила размытия (1-50)")
 
+    @field_validator('masks')
+    @classmethod
+    def check_masks(cls, masks):
+        return validate_masks(masks)
+
 class StatusResponse(BaseModel):
     """Ответ со статусом обработки"""
     video_id: str
@@ -0,0 +1,167 @@
+# session_store.py
+import os
+import threading
+import orjson
+from typing import Dict, Any, Optional, List
+from models import ProcessingStatus
+
+# Количество полос блокировок для сессий
+SESSION_LOCK_STRIPES = 32
+# Время жизни сессии в Redis (секунды)
+SESSION_TTL_SECONDS = 24 * 3600
+# Таймауты соединения с Redis (секунды): запросы идут из цикла событий,
+# недоступный Redis не должен подвешивать весь API
+REDIS_SOCKET_TIMEOUT_SECONDS = 2
+
+class InMemorySessionStore:
+    """Хранилище сессий в памяти процесса (один воркер uvicorn)"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict] = {}
+        # Полосатые блокировки: сессии изменяются и обработчиками запросов,
+        # и фоновыми задачами (в том числе из рабочих потоков)
+        self._locks = [threading.RLock() for _ in range(SESSION_LOCK_STRIPES)]
+
+    def _lock(self, video_id: str) -> threading.RLock:
+        """Возвращает блокировку, отвечающую за сессию"""
+        return self._locks[hash(video_id) % SESSION_LOCK_STRIPES]
+
+    def __contains__(self, video_id: str) -> bool:
+        return video_id in self._sessions
+
+    def ids(self) -> List[str]:
+        """Возвращает идентификаторы всех сессий"""
+        return list(self._sessions.keys())
+
+    def put(self, video_id: str, session: Dict):
+        """Сохраняет новую сессию"""
+        with self._lock(video_id):
+            self._sessions[video_id] = session
+
+    def get(self, video_id: str) -> Optional[Dict]:
+        """Возвращает согласованный снимок сессии"""
+        with self._lock(video_id):
+            session = self._sessions.get(video_id)
+            if not session:
+                return None
+            snapshot = dict(session)
+            snapshot['files'] = dict(session['files'])
+            return snapshot
+
+    def update(self, video_id: str, **fields):
+        """Обновляет поля существующей сессии"""
+        with self._lock(video_id):
+            session = self._sessions.get(video_id)
+            if session:
+                session.update(fields)
+
+    def set_file(self, video_id: str, kind: str, file_path: str):
+        """Запоминает путь к файлу сессии"""
+        with self._lock(video_id):
+            self._sessions[video_id]['files'][kind] = file_path
+
+    def pop(self, video_id: str) -> Optional[Dict]:
+        """Удаляет сессию и возвращает ее"""
+        with self._lock(video_id):
+            return self._sessions.pop(video_id, None)
+
+class RedisSessionStore:
+    """Хранилище сессий в Redis, общее для нескольких воркеров uvicorn
+
+    Каждая сессия - хэш session:{video_id}; значения полей сериализуются orjson,
+    пути к файлам хранятся отдельными полями files.{kind}.
+    """
+
+    FILE_PREFIX = 'files.'
+    # HSET только в существующий хэш: после истечения TTL обновление не должно
+    # создавать новый хэш без TTL и без поля status
+    UPDATE_IF_EXISTS_SCRIPT = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            redis.call('HSET', KEYS[1], unpack(ARGV))
+            return 1
+        end
+        return 0
+    """
+
+    def __init__(self, redis_url: str, ttl_seconds: int = SESSION_TTL_SECONDS):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("redis not available. Please install: pip install redis")
+
+        self.client = redis.Redis.from_url(redis_url,
+                                           socket_timeout=REDIS_SOCKET_TIMEOUT_SECONDS,
+                                           socket_connect_timeout=REDIS_SOCKET_TIMEOUT_SECONDS)
+        self.ttl_seconds = ttl_seconds
+        self._update_if_exists = self.client.register_script(self.UPDATE_IF_EXISTS_SCRIPT)
+
+    @staticmethod
+    def _key(video_id: str) -> str:
+        return f"session:{video_id}"
+
+    def __contains__(self, video_id: str) -> bool:
+        return bool(self.client.exists(self._key(video_id)))
+
+    def ids(self) -> List[str]:
+        """Возвращает идентификаторы всех сессий"""
+        return [key.decode().split(':', 1)[1] for key in self.client.scan_iter(match="session:*")]
+
+    def _encode(self, fields: Dict[str, Any]) -> Dict[str, bytes]:
+        return {name: orjson.dumps(value) for name, value in fields.items()}
+
+    def put(self, video_id: str, session: Dict):
+        """Сохраняет новую сессию с TTL вместо периодической очистки"""
+        fields = {name: value for name, value in session.items() if name != 'files'}
+        for kind, file_path in session['files'].items():
+            fields[self.FILE_PREFIX + kind] = file_path
+
+        key = self._key(video_id)
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, mapping=self._encode(fields))
+            pipe.expire(key, self.ttl_seconds)
+            pipe.execute()
+
+    def get(self, video_id: str) -> Optional[Dict]:
+        """Возвращает сессию одним HGETALL"""
+        raw = self.client.hgetall(self._key(video_id))
+        # Хэш без status - не сессия (например, остаток записи после истечения TTL)
+        if b'status' not in raw:
+            return None
+
+        session: Dict[str, Any] = {'files': {}}
+        for name, value in raw.items():
+            name = name.decode()
+            value = orjson.loads(value)
+            if name.startswith(self.FILE_PREFIX):
+                session['files'][name[len(self.FILE_PREFIX):]] = value
+            else:
+                session[name] = value
+
+        session['status'] = ProcessingStatus(session['status'])
+        return session
+
+    def update(self, video_id: str, **fields):
+        """Обновляет поля существующей сессии (атомарно, только если она еще есть)"""
+        if not fields:
+            return
+        args = [item for pair in self._encode(fields).items() for item in pair]
+        self._update_if_exists(keys=[self._key(video_id)], args=args)
+
+    def set_file(self, video_id: str, kind: str, file_path: str):
+        """Запоминает путь к файлу сессии"""
+        self._update_if_exists(keys=[self._key(video_id)],
+                               args=[self.FILE_PREFIX + kind, orjson.dumps(file_path)])
+
+    def pop(self, video_id: str) -> Optional[Dict]:
+        """Удаляет сессию и возвращает ее"""
+        session = self.get(video_id)
+        if session:
+            self.client.delete(self._key(video_id))
+        return session
+
+def create_session_store():
+    """Создает хранилище сессий: Redis, если задан REDIS_URL, иначе память процесса"""
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url:
+        return RedisSessionStore(redis_url)
+    return InMemorySessionStore()
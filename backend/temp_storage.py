@@ -1,39 +1,113 @@
 # temp_storage.py - ОБНОВЛЕННАЯ ВЕРСИЯ
 import os
-import shutil
-import json
+import sys
 import uuid
-from typing import Dict, Any, Optional
-from datetime import datetime, timedelta
+import asyncio
+import aiofiles
+import orjson
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+import time
 from models import ProcessingStatus
+from session_store import create_session_store
+
+# Размер блока при потоковой записи загружаемых файлов
+UPLOAD_CHUNK_SIZE = 1 << 20
+# Имена файлов сессии по их типу
+SESSION_FILE_NAMES = {
+    'uploaded_video': 'original_video.mp4',
+    'analysis_json': 'analysis_result.json',
+    'preview_video': 'preview.mp4',
+    'output_video': 'processed_video.mp4',
+}
+# Сколько разобранных результатов анализа держать в памяти (LRU)
+ANALYSIS_CACHE_SIZE = 32
+# Копирование файл->файл через sendfile(2) поддерживается только в Linux
+KERNEL_COPY_SUPPORTED = sys.platform.startswith('linux') and hasattr(os, 'sendfile')
+
+def _drop_page_cache(fd: int):
+    """Подсказывает ядру, что записанные страницы файла больше не нужны в кэше"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+def _kernel_copy(src_file, dst_path: str):
+    """Копирует файл в ядре через sendfile(2), минуя буферы Python"""
+    # fileno() сбрасывает SpooledTemporaryFile из памяти на диск, если нужно
+    src_fd = src_file.fileno()
+    size = os.fstat(src_fd).st_size
+    
+    with open(dst_path, 'wb') as dst:
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+            if sent == 0:
+                break
+            offset += sent
+        
+        # Видео будет прочитано только при анализе - не вытесняем им более горячие данные
+        _drop_page_cache(dst.fileno())
+
+def _rmtree_fast(path: str):
+    """Рекурсивно удаляет директорию через os.scandir/os.unlink"""
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    _rmtree_fast(entry.path)
+                else:
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        pass
+        os.rmdir(path)
+    except FileNotFoundError:
+        pass
+
+def _stale_dirs(base_dir: str, cutoff_time: float) -> list:
+    """Возвращает поддиректории, не изменявшиеся с cutoff_time"""
+    with os.scandir(base_dir) as entries:
+        return [entry for entry in entries
+                if entry.is_dir() and entry.stat().st_mtime < cutoff_time]
 
 class TempStorage:
     """Управление временными файлами для веб-версии"""
     
     def __init__(self, base_temp_dir: str = "web_temp_uploads"):
         self.base_temp_dir = base_temp_dir
-        self.sessions: Dict[str, Dict] = {}
+        # Хранилище сессий: память процесса или Redis (REDIS_URL) для нескольких воркеров
+        self.sessions = create_session_store()
+        # LRU-кэш разобранных результатов анализа: video_id -> (mtime_ns, данные)
+        self._analysis_cache: 'OrderedDict[str, Tuple[int, Dict[str, Any]]]' = OrderedDict()
+        # Пути к файлам сессий, вычисляемые один раз на video_id
+        self._paths: Dict[str, Dict[str, str]] = {}
         
         # Создаем базовую директорию
         os.makedirs(self.base_temp_dir, exist_ok=True)
-        
-        # Запускаем очистку старых файлов
-        self._cleanup_old_files()
+    
+    def _session_paths(self, video_id: str) -> Dict[str, str]:
+        """Возвращает заранее вычисленные пути сессии"""
+        paths = self._paths.get(video_id)
+        if paths is None:
+            session_dir = os.path.join(self.base_temp_dir, video_id)
+            paths = {kind: os.path.join(session_dir, name) for kind, name in SESSION_FILE_NAMES.items()}
+            paths['session_dir'] = session_dir
+            self._paths[video_id] = paths
+        return paths
     
     def generate_video_id(self) -> str:
         """Генерирует уникальный идентификатор видео"""
-        return str(uuid.uuid4())
+        return uuid.uuid4().hex
     
     def create_session(self, video_id: str, original_filename: str) -> str:
         """Создает новую сессию обработки"""
-        session_dir = os.path.join(self.base_temp_dir, video_id)
+        session_dir = self.get_session_dir(video_id)
         os.makedirs(session_dir, exist_ok=True)
         
-        self.sessions[video_id] = {
+        session = {
             'video_id': video_id,
             'original_filename': original_filename,
             'session_dir': session_dir,
-            'created_at': datetime.now(),
+            'created_at': time.time(),
             'status': ProcessingStatus.UPLOADED,
             'progress': 0.0,
             'message': 'Video uploaded',
@@ -45,101 +119,146 @@ class TempStorage:
             }
         }
         
+        self.sessions.put(video_id, session)
+        
         return session_dir
     
-    def save_uploaded_file(self, video_id: str, file_content: bytes) -> str:
-        """Сохраняет загруженный видеофайл"""
+    async def save_uploaded_file_stream(self, video_id: str, upload_file) -> str:
+        """Потоково сохраняет загруженный видеофайл блоками по UPLOAD_CHUNK_SIZE"""
         if video_id not in self.sessions:
             raise ValueError(f"Session {video_id} not found")
         
-        session_dir = self.get_session_dir(video_id)
-        file_path = os.path.join(session_dir, "original_video.mp4")
+        file_path = self.get_target_path(video_id, 'uploaded_video')
         
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
+        if KERNEL_COPY_SUPPORTED:
+            # Starlette уже сохранил тело запроса во временный файл - копируем его
+            # целиком в ядре одним вызовом в пуле потоков, без промежуточных bytes
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, _kernel_copy, upload_file.file, file_path)
+        else:
+            async with aiofiles.open(file_path, 'wb', buffering=UPLOAD_CHUNK_SIZE) as f:
+                while chunk := await upload_file.read(UPLOAD_CHUNK_SIZE):
+                    await f.write(chunk)
+                await f.flush()
+                _drop_page_cache(f.fileno())
         
-        self.sessions[video_id]['files']['uploaded_video'] = file_path
+        self.sessions.set_file(video_id, 'uploaded_video', file_path)
         self.update_session_status(video_id, ProcessingStatus.UPLOADED, "Video uploaded successfully")
         
         return file_path
     
     def get_session_dir(self, video_id: str) -> str:
         """Возвращает путь к директории сессии"""
-        return os.path.join(self.base_temp_dir, video_id)
+        return self._session_paths(video_id)['session_dir']
+    
+    def get_target_path(self, video_id: str, kind: str) -> str:
+        """Возвращает путь, по которому сохраняется файл сессии данного типа"""
+        return self._session_paths(video_id)[kind]
     
     def save_analysis_result(self, video_id: str, analysis_data: Dict[str, Any]) -> str:
         """Сохраняет результаты анализа в JSON"""
-        session_dir = self.get_session_dir(video_id)
-        json_path = os.path.join(session_dir, "analysis_result.json")
+        json_path = self.get_target_path(video_id, 'analysis_json')
         
-        with open(json_path, 'w', encoding='utf-8') as f:
-            json.dump(analysis_data, f, indent=2, ensure_ascii=False)
+        with open(json_path, 'wb') as f:
+            f.write(orjson.dumps(analysis_data, option=orjson.OPT_NON_STR_KEYS))
         
-        self.sessions[video_id]['files']['analysis_json'] = json_path
+        self._analysis_cache.pop(video_id, None)
+        self.sessions.set_file(video_id, 'analysis_json', json_path)
         return json_path
     
     def get_analysis_result(self, video_id: str) -> Optional[Dict[str, Any]]:
         """Загружает результаты анализа из JSON"""
-        if video_id not in self.sessions:
+        session = self.sessions.get(video_id)
+        if not session:
+            return None
+        
+        json_path = session['files'].get('analysis_json')
+        if not json_path:
             return None
         
-        json_path = self.sessions[video_id]['files'].get('analysis_json')
-        if not json_path or not os.path.exists(json_path):
+        try:
+            mtime = os.stat(json_path).st_mtime_ns
+        except FileNotFoundError:
+            self._analysis_cache.pop(video_id, None)
             return None
         
-        with open(json_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        # Файл не менялся с последнего чтения - отдаем из кэша
+        cached = self._analysis_cache.get(video_id)
+        if cached and cached[0] == mtime:
+            self._analysis_cache.move_to_end(video_id)
+            return cached[1]
+        
+        with open(json_path, 'rb') as f:
+            analysis_data = orjson.loads(f.read())
+        
+        self._analysis_cache[video_id] = (mtime, analysis_data)
+        self._analysis_cache.move_to_end(video_id)
+        if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+            self._analysis_cache.popitem(last=False)
+        return analysis_data
     
     def save_preview_video(self, video_id: str, preview_path: str) -> str:
         """Сохраняет путь к превью видео"""
-        self.sessions[video_id]['files']['preview_video'] = preview_path
+        self.sessions.set_file(video_id, 'preview_video', preview_path)
         return preview_path
     
     def save_output_video(self, video_id: str, output_path: str) -> str:
         """Сохраняет путь к обработанному видео"""
-        self.sessions[video_id]['files']['output_video'] = output_path
+        self.sessions.set_file(video_id, 'output_video', output_path)
         return output_path
     
     def get_session_info(self, video_id: str) -> Optional[Dict]:
-        """Возвращает информацию о сессии"""
+        """Возвращает согласованный снимок информации о сессии"""
         return self.sessions.get(video_id)
     
     def update_session_status(self, video_id: str, status: ProcessingStatus, 
                             message: str = "", progress: float = 0.0):
         """Обновляет статус сессии"""
-        if video_id in self.sessions:
-            self.sessions[video_id]['status'] = status
-            self.sessions[video_id]['message'] = message
-            self.sessions[video_id]['progress'] = progress
+        self.sessions.update(video_id, status=status, message=message, progress=progress)
+    
+    def _get_file(self, video_id: str, kind: str) -> Optional[str]:
+        """Возвращает путь к файлу сессии"""
+        session = self.sessions.get(video_id)
+        return session['files'].get(kind) if session else None
     
     def get_video_path(self, video_id: str) -> Optional[str]:
         """Возвращает путь к оригинальному видео"""
-        return self.sessions.get(video_id, {}).get('files', {}).get('uploaded_video')
+        return self._get_file(video_id, 'uploaded_video')
     
     def get_preview_path(self, video_id: str) -> Optional[str]:
         """Возвращает путь к превью"""
-        return self.sessions.get(video_id, {}).get('files', {}).get('preview_video')
+        return self._get_file(video_id, 'preview_video')
     
     def get_output_path(self, video_id: str) -> Optional[str]:
         """Возвращает путь к обработанному видео"""
-        return self.sessions.get(video_id, {}).get('files', {}).get('output_video')
-    
-    def cleanup_session(self, video_id: str):
-        """Удаляет все файлы сессии"""
-        if video_id in self.sessions:
-            session_dir = self.get_session_dir(video_id)
-            if os.path.exists(session_dir):
-                shutil.rmtree(session_dir)
-            del self.sessions[video_id]
-    
-    def _cleanup_old_files(self, hours_old: int = 24):
-        """Очищает файлы старше указанного количества часов"""
-        cutoff_time = datetime.now() - timedelta(hours=hours_old)
-        
-        for video_id in list(self.sessions.keys()):
-            session = self.sessions[video_id]
-            if session['created_at'] < cutoff_time:
-                self.cleanup_session(video_id)
+        return self._get_file(video_id, 'output_video')
+    
+    async def cleanup_session(self, video_id: str):
+        """Удаляет все файлы сессии (в пуле потоков, не блокируя event loop)"""
+        session = self.sessions.pop(video_id)
+        self._analysis_cache.pop(video_id, None)
+        
+        if session:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, _rmtree_fast, self.get_session_dir(video_id))
+        self._paths.pop(video_id, None)
+    
+    async def cleanup_old_files(self, hours_old: int = 24):
+        """Очищает сессии и файлы старше указанного количества часов"""
+        cutoff_time = time.time() - hours_old * 3600
+        
+        for video_id in self.sessions.ids():
+            session = self.sessions.get(video_id)
+            if session and session['created_at'] < cutoff_time:
+                await self.cleanup_session(video_id)
+        
+        # Удаляем осиротевшие директории (например, после падения сервера),
+        # о которых хранилище сессий уже ничего не знает
+        loop = asyncio.get_running_loop()
+        for entry in await loop.run_in_executor(None, _stale_dirs, self.base_temp_dir, cutoff_time):
+            await loop.run_in_executor(None, _rmtree_fast, entry.path)
+            self._paths.pop(entry.name, None)
+            self._analysis_cache.pop(entry.name, None)
 
 # Глобальный экземпляр хранилища
 temp_storage = TempStorage()
\ No newline at end of file
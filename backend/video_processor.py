@@ -1,15 +1,218 @@
 import cv2
 import numpy as np
-import json
+import orjson
 import os
+import queue
+import threading
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 import logging
+from video_writer import open_video_writer, remux_video
+from blur_kernels import NUMBA_AVAILABLE
+
+if NUMBA_AVAILABLE:
+    from blur_kernels import pixelate_boxes
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Максимальная ширина кадра, на которой запускается детектор лиц
+DETECTION_MAX_WIDTH = 640
+# Емкость очередей конвейера декодирование -> размытие -> кодирование
+PIPELINE_PREFETCH = 16
+# Минимум анализируемых кадров на один параллельный диапазон
+MIN_ANALYZED_FRAMES_PER_RANGE = 20
+# Сторона миниатюры кадра для сравнения соседних анализируемых кадров
+FRAME_THUMB_SIZE = 32
+# Порог расстояния Хэмминга между 8x8 mean-hash "почти одинаковых" кадров
+FRAME_HASH_MAX_DISTANCE = 4
+# Максимальное отличие пикселя миниатюр: хэш не замечает небольшого сдвига лица,
+# а устаревший прямоугольник открыл бы часть лица
+FRAME_THUMB_MAX_DIFF = 12
+
+def _log_dlib_build(dlib):
+    """Логирует параметры сборки dlib: без SIMD HOG-детектор в разы медленнее"""
+    flags = {name: getattr(dlib, name, None) for name in
+             ('USE_AVX_INSTRUCTIONS', 'USE_NEON_INSTRUCTIONS', 'DLIB_USE_CUDA',
+              'DLIB_USE_BLAS', 'DLIB_USE_LAPACK')}
+    logger.info(f"dlib {dlib.__version__} build: " +
+                ", ".join(f"{name}={value}" for name, value in flags.items()))
+    
+    if not (flags['USE_AVX_INSTRUCTIONS'] or flags['USE_NEON_INSTRUCTIONS']):
+        logger.warning("dlib was built without AVX/NEON instructions, face detection will be slow. "
+                       "Rebuild it with ./build_dlib.sh")
+
+def _drop_page_cache(path: str):
+    """Подсказывает ядру выгрузить страницы прочитанного/записанного видео из кэша"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+def default_frame_skip(fps: float) -> int:
+    """Шаг анализа по умолчанию - два кадра в секунду"""
+    return max(1, int(fps / 2))
+
+def split_frame_ranges(total_frames: int, parts: int,
+                       frame_skip: int = 1) -> List[Tuple[int, Optional[int]]]:
+    """
+    Делит видео на непрерывные диапазоны кадров для параллельного анализа
+    
+    Границы кратны frame_skip, чтобы анализировались те же кадры, что и при
+    последовательном проходе. Последний диапазон открыт (до конца видео),
+    так как CAP_PROP_FRAME_COUNT бывает неточным.
+    """
+    analyzed_frames = max(1, -(-total_frames // frame_skip))
+    parts = max(1, min(parts, analyzed_frames // MIN_ANALYZED_FRAMES_PER_RANGE))
+    step = -(-analyzed_frames // parts) * frame_skip
+    
+    starts = [i * step for i in range(parts) if i * step < max(total_frames, 1)]
+    return [(start, starts[i + 1] if i + 1 < len(starts) else None)
+            for i, start in enumerate(starts)]
+
+def build_analysis_result(video_info: Dict, faces_by_frame: Dict, frame_skip: int) -> Dict:
+    """Собирает результат анализа в формате, который сохраняется и отдается клиенту"""
+    return {
+        'video_info': video_info,
+        'faces_by_frame': faces_by_frame,
+        'analysis_settings': {
+            'total_analyzed_frames': len(faces_by_frame),
+            'frame_skip': frame_skip
+        }
+    }
+
+def _frame_signature(frame: np.ndarray) -> Tuple[int, np.ndarray]:
+    """Возвращает 8x8 mean-hash и полутоновую миниатюру кадра"""
+    thumb = cv2.cvtColor(
+        cv2.resize(frame, (FRAME_THUMB_SIZE, FRAME_THUMB_SIZE), interpolation=cv2.INTER_AREA),
+        cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(thumb, (8, 8), interpolation=cv2.INTER_AREA)
+    return int.from_bytes(np.packbits(small > small.mean()).tobytes(), 'big'), thumb
+
+def _same_scene(signature: Tuple[int, np.ndarray], anchor: Optional[Tuple[int, np.ndarray]]) -> bool:
+    """Проверяет, что кадр почти не отличается от кадра, на котором работал детектор"""
+    if anchor is None:
+        return False
+    if bin(signature[0] ^ anchor[0]).count('1') >= FRAME_HASH_MAX_DISTANCE:
+        return False
+    return int(cv2.absdiff(signature[1], anchor[1]).max()) <= FRAME_THUMB_MAX_DIFF
+
+def _face_records(faces: List['FaceBoundingBox']) -> List[Dict]:
+    """Преобразует найденные лица в словари для результата анализа"""
+    return [
+        {'x': face.x, 'y': face.y, 'width': face.width,
+         'height': face.height, 'confidence': face.confidence}
+        for face in faces
+    ]
+
+def _interpolate_boxes(prev_boxes: List[tuple], next_boxes: List[tuple],
+                       t: float) -> List[tuple]:
+    """
+    Линейная интерполяция прямоугольников между двумя проанализированными кадрами
+
+    Каждому прямоугольнику предыдущего кадра сопоставляется ближайший по центру
+    прямоугольник следующего; t - доля пути от предыдущего кадра (t > 1 -
+    экстраполяция за следующий кадр).
+    """
+    result = []
+    for box in prev_boxes:
+        cx, cy = box[0] + box[2], box[1] + box[3]
+        target = min(next_boxes,
+                     key=lambda other: (other[0] + other[2] - cx) ** 2 + (other[1] + other[3] - cy) ** 2)
+        result.append(tuple(round(a + (b - a) * t) for a, b in zip(box, target)))
+    return result
+
+def _held_boxes(boxes_by_frame: Dict[int, List[tuple]], frame_number: int,
+                frame_skip: int, total_frames: int) -> List[tuple]:
+    """
+    Маски, переносимые на кадр между проанализированными: объединение масок
+    соседних проанализированных кадров и интерполяция (для самих
+    проанализированных кадров - пусто)
+    """
+    offset = frame_number % frame_skip
+    if offset == 0:
+        return []
+    base = frame_number - offset
+    prev_boxes = boxes_by_frame.get(base, [])
+    if base + frame_skip >= total_frames and base + frame_skip not in boxes_by_frame:
+        # Хвост видео: следующего проанализированного кадра нет - продолжаем
+        # движение по двум последним проанализированным кадрам
+        before_boxes = boxes_by_frame.get(base - frame_skip, [])
+        if not prev_boxes or not before_boxes:
+            return prev_boxes
+        return prev_boxes + _interpolate_boxes(before_boxes, prev_boxes, 1 + offset / frame_skip)
+    next_boxes = boxes_by_frame.get(base + frame_skip, [])
+    if not prev_boxes or not next_boxes:
+        return prev_boxes + next_boxes
+    return prev_boxes + next_boxes + _interpolate_boxes(prev_boxes, next_boxes, offset / frame_skip)
+
+def build_frame_masks(masks_data: Dict, total_frames: int,
+                      frame_skip: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Преобразует маски в CSR-массивы: смещения int32[T + 1] и прямоугольники int32[M, 4]
+    
+    Прямоугольники (x1, y1, x2, y2) кадра n - срез boxes[offsets[n]:offsets[n + 1]],
+    без поиска по строковому ключу и без выделения памяти в цикле обработки.
+    Кадры между анализируемыми, помимо собственных масок, получают объединение масок
+    соседних проанализированных кадров (предыдущего и следующего) и промежуточные
+    прямоугольники, интерполированные между ними: лицо в движении остается закрытым
+    на всем отрезке, а не только у предыдущего проанализированного кадра. После
+    последнего проанализированного кадра движение экстраполируется.
+    """
+    boxes_by_frame = {
+        int(frame_key): [
+            (int(mask['x']), int(mask['y']),
+             int(mask['x']) + int(mask['width']), int(mask['y']) + int(mask['height']))
+            for mask in frame_masks
+        ]
+        for frame_key, frame_masks in masks_data.items() if frame_masks
+    }
+    # CAP_PROP_FRAME_COUNT бывает неточным - покрываем и все кадры с масками
+    length = max([total_frames] + [n + frame_skip for n in boxes_by_frame])
+    # Собственные маски кадра (клиент может задать их для любого кадра)
+    # вместе с масками соседних проанализированных кадров
+    per_frame = [boxes_by_frame.get(n, []) + _held_boxes(boxes_by_frame, n, frame_skip, total_frames)
+                 for n in range(length)]
+    
+    offsets = np.zeros(length + 1, dtype=np.int32)
+    np.cumsum([len(frame_boxes) for frame_boxes in per_frame], out=offsets[1:])
+    boxes = np.array([box for frame_boxes in per_frame for box in frame_boxes],
+                     dtype=np.int32).reshape(-1, 4)
+    return offsets, boxes
+
+def _read_frames(cap: cv2.VideoCapture, read_q: queue.Queue, stop: threading.Event,
+                 errors: List[Exception]):
+    """Поток декодирования: кладет кадры в очередь, в конце - None"""
+    try:
+        while not stop.is_set() and cap.grab():
+            ret, frame = cap.retrieve()
+            if not ret:
+                # grab() прошел - это ошибка декодирования, а не конец видео
+                raise ValueError("Cannot decode video frame")
+            read_q.put(frame)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        read_q.put(None)
+
+def _write_frames(out, write_q: queue.Queue, errors: List[Exception]):
+    """Поток кодирования: записывает кадры из очереди до получения None"""
+    try:
+        while (frame := write_q.get()) is not None:
+            out.write(frame)
+    except Exception as e:
+        errors.append(e)
+        # Дочитываем очередь до None, чтобы стадия размытия не блокировалась на put
+        while write_q.get() is not None:
+            pass
+
 @dataclass
 class FaceBoundingBox:
     """Класс для представления ограничивающего прямоугольника лица"""
@@ -22,16 +225,19 @@ class FaceBoundingBox:
 class VideoProcessor:
     """Основной класс для обработки видео и размытия лиц с использованием dlib"""
     
-    def __init__(self, use_cnn: bool = False):
+    def __init__(self, use_cnn: bool = False, use_cuda: bool = False):
         """
         Инициализация детектора лиц dlib
         
         Args:
             use_cnn: Использовать ли CNN модель (точнее но медленнее)
+            use_cuda: Пикселизировать на GPU, если OpenCV собран с CUDA.
+                Каждый такой экземпляр создает свой контекст CUDA
         """
         try:
             import dlib
             self.dlib = dlib
+            _log_dlib_build(dlib)
             self.detector = None
             self.cnn_detector = None
             
@@ -50,6 +256,35 @@ class VideoProcessor:
                 
         except ImportError:
             raise ImportError("dlib not available. Please install: pip install dlib")
+        
+        # Буферы detect_faces, переиспользуемые от кадра к кадру
+        self._buffers: Dict[str, np.ndarray] = {}
+        
+        # Пикселизация на GPU, если она запрошена, OpenCV собран с CUDA и есть устройство
+        self.cuda_stream = None
+        if (use_cuda and hasattr(cv2, 'cuda') and hasattr(cv2.cuda, 'resize')
+                and cv2.cuda.getCudaEnabledDeviceCount() > 0):
+            logger.info("Using CUDA for face pixelation")
+            self.cuda_stream = cv2.cuda_Stream()
+            self._gpu_frame = cv2.cuda_GpuMat()
+    
+    def warmup(self):
+        """
+        Прогревает детектор и пикселизацию на пустом кадре
+        
+        Первый вызов платит за ленивую инициализацию dlib, загрузку ядра numba
+        из кэша и создание контекста CUDA - пусть это произойдет до первой задачи.
+        """
+        frame = np.zeros((360, DETECTION_MAX_WIDTH, 3), dtype=np.uint8)
+        self.detect_faces(frame)
+        self.apply_blur_to_frame(frame, np.array([[0, 0, 64, 64]], dtype=np.int32), 15)
+    
+    def _buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """Возвращает преаллоцированный буфер uint8, пересоздавая его при смене размера"""
+        buf = self._buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buf
     
     def _find_cnn_model(self) -> Optional[str]:
         """Пытается найти CNN модель dlib"""
@@ -69,14 +304,18 @@ class VideoProcessor:
         logger.warning("CNN model file 'mmod_human_face_detector.dat' not found.")
         return None
     
-    def analyze_video(self, video_path: str, output_json_path: Optional[str] = None) -> Dict:
+    def analyze_video(self, video_path: str, output_json_path: Optional[str] = None,
+                      frame_skip: Optional[int] = None, track: bool = False) -> Dict:
         """
         Анализирует видео и обнаруживает лица в кадрах с помощью dlib
         
         Args:
             video_path: Путь к исходному видео файлу
             output_json_path: Путь для сохранения результатов анализа (опционально)
-            frame_skip: Анализировать каждый N-ый кадр (для ускорения)
+            frame_skip: Анализировать каждый N-ый кадр (для ускорения),
+                по умолчанию - два кадра в секунду
+            track: Между кадрами детектора вести лица трекером KCF
+                (маски получаются для каждого кадра)
             
         Returns:
             Словарь с результатами анализа
@@ -98,55 +337,164 @@ class VideoProcessor:
         logger.info(f"Analyzing video: {video_path}")
         logger.info(f"Resolution: {width}x{height}, FPS: {fps}, Duration: {duration:.2f}s")
         
-        faces_by_frame = {}
-        frame_number = 0
+        # Положение лиц меняется плавно, поэтому детектор запускается
+        # только на каждом frame_skip-ом кадре
+        if frame_skip is None:
+            frame_skip = default_frame_skip(fps)
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            faces = self.detect_faces(frame)
-            if faces:
-                faces_by_frame[str(frame_number)] = [
-                    {'x': face.x, 'y': face.y, 'width': face.width, 
-                     'height': face.height, 'confidence': face.confidence}
-                    for face in faces
-                ]
-                
-            if frame_number % 100 == 0:
-                logger.info(f"Processed frame {frame_number}/{total_frames} - found {len(faces)} faces")
-            
-            frame_number += 1
+        faces_by_frame = self._analyze_range(cap, 0, None, frame_skip, total_frames, track)
         
         cap.release()
+        # Видео однократно прочитано целиком - освобождаем кэш страниц
+        _drop_page_cache(video_path)
         
         # Создаем результат анализа
-        analysis_result = {
-            'video_info': {
-                'file_path': video_path,
-                'fps': fps,
-                'total_frames': total_frames,
-                'duration': duration,
-                'width': width,
-                'height': height
-            },
-            'faces_by_frame': faces_by_frame,
-            'analysis_settings': {
-                'total_analyzed_frames': len(faces_by_frame)
-            }
-        }
+        analysis_result = build_analysis_result({
+            'file_path': video_path,
+            'fps': fps,
+            'total_frames': total_frames,
+            'duration': duration,
+            'width': width,
+            'height': height
+        }, faces_by_frame, 1 if track else frame_skip)
         
         # Сохраняем результаты в JSON если указан путь
         if output_json_path:
             os.makedirs(os.path.dirname(output_json_path), exist_ok=True)
-            with open(output_json_path, 'w', encoding='utf-8') as f:
-                json.dump(analysis_result, f, indent=2, ensure_ascii=False)
+            # orjson сериализует в C без отступов - на длинных видео в разы быстрее json.dump
+            with open(output_json_path, 'wb') as f:
+                f.write(orjson.dumps(analysis_result))
             logger.info(f"Analysis results saved to: {output_json_path}")
         
         logger.info(f"Analysis complete. Detected faces in {len(faces_by_frame)} frames")
         return analysis_result
     
+    def analyze_frame_range(self, video_path: str, start: int, stop: Optional[int],
+                            frame_skip: int, track: bool = False) -> Dict:
+        """
+        Анализирует диапазон кадров [start, stop) - часть параллельного анализа
+        
+        Args:
+            video_path: Путь к исходному видео файлу
+            start: Первый кадр диапазона (кратен frame_skip)
+            stop: Кадр, на котором анализ останавливается (None - до конца видео)
+            frame_skip: Анализировать каждый N-ый кадр
+            track: Вести лица трекером между кадрами детектора (см. analyze_video)
+            
+        Returns:
+            Словарь {номер кадра: [лица]} для кадров диапазона
+        """
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Cannot open video file: {video_path}")
+        
+        try:
+            if start > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            return self._analyze_range(cap, start, stop, frame_skip, total_frames, track)
+        finally:
+            cap.release()
+    
+    def _analyze_range(self, cap: cv2.VideoCapture, start: int, stop: Optional[int],
+                       frame_skip: int, total_frames: int, track: bool) -> Dict:
+        """Выбирает режим анализа диапазона: детектор с пропуском кадров или трекер"""
+        if track:
+            return self._track_in_range(cap, start, stop, frame_skip, total_frames)
+        return self._detect_in_range(cap, start, stop, frame_skip, total_frames)
+    
+    def _detect_in_range(self, cap: cv2.VideoCapture, start: int, stop: Optional[int],
+                         frame_skip: int, total_frames: int) -> Dict:
+        """Ищет лица на каждом frame_skip-ом кадре, начиная с текущей позиции cap"""
+        faces_by_frame = {}
+        frame_number = start
+        # Кадр, на котором последний раз запускался детектор, и его результат
+        anchor, anchor_faces = None, []
+        
+        while stop is None or frame_number < stop:
+            # grab() только продвигает поток, декодируется лишь анализируемый кадр
+            if not cap.grab():
+                break
+            
+            if frame_number % frame_skip == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                
+                # Лица на соседних кадрах почти не двигаются: если кадр совпадает
+                # с опорным, повторно используем его детекции вместо детектора
+                signature = _frame_signature(frame)
+                if _same_scene(signature, anchor):
+                    faces = anchor_faces
+                else:
+                    faces = self.detect_faces(frame)
+                    anchor, anchor_faces = signature, faces
+                
+                if faces:
+                    faces_by_frame[str(frame_number)] = _face_records(faces)
+                
+                if frame_number % (100 * frame_skip) == 0:
+                    logger.info(f"Processed frame {frame_number}/{total_frames} - found {len(faces)} faces")
+            
+            frame_number += 1
+        
+        return faces_by_frame
+    
+    def _track_in_range(self, cap: cv2.VideoCapture, start: int, stop: Optional[int],
+                        keyframe_interval: int, total_frames: int) -> Dict:
+        """
+        Запускает детектор на ключевых кадрах, а между ними ведет лица трекером KCF
+        
+        Декодируется каждый кадр, маски записываются для всех кадров с лицами.
+        Трекеры работают на кадре, уменьшенном до DETECTION_MAX_WIDTH. Если трекер
+        теряет лицо, детектор запускается на текущем кадре вне очереди.
+        """
+        faces_by_frame = {}
+        frame_number = start
+        trackers = []
+        
+        while stop is None or frame_number < stop:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            
+            height, width = frame.shape[:2]
+            scale = min(1.0, DETECTION_MAX_WIDTH / width)
+            small = frame if scale == 1.0 else cv2.resize(
+                frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+            
+            faces = []
+            lost = False
+            if frame_number % keyframe_interval != 0:
+                for tracker, confidence in trackers:
+                    ok, (x, y, w, h) = tracker.update(small)
+                    if not ok:
+                        lost = True
+                        break
+                    x = max(0, int(x / scale))
+                    y = max(0, int(y / scale))
+                    faces.append(FaceBoundingBox(x, y, min(width - x, int(w / scale)),
+                                                 min(height - y, int(h / scale)), confidence))
+            
+            if frame_number % keyframe_interval == 0 or lost:
+                faces = self.detect_faces(frame)
+                trackers = []
+                for face in faces:
+                    tracker = cv2.TrackerKCF_create()
+                    tracker.init(small, (int(face.x * scale), int(face.y * scale),
+                                         max(1, int(face.width * scale)), max(1, int(face.height * scale))))
+                    trackers.append((tracker, face.confidence))
+            
+            if faces:
+                faces_by_frame[str(frame_number)] = _face_records(faces)
+            
+            if frame_number % (100 * keyframe_interval) == 0:
+                logger.info(f"Processed frame {frame_number}/{total_frames} - found {len(faces)} faces")
+            
+            frame_number += 1
+        
+        return faces_by_frame
+    
     def detect_faces(self, frame: np.ndarray) -> List[FaceBoundingBox]:
         """
         Обнаруживает лица в одном кадре с помощью dlib
@@ -157,15 +505,23 @@ class VideoProcessor:
         Returns:
             Список ограничивающих прямоугольников лиц
         """
-        # Конвертируем BGR в RGB (dlib работает с RGB)
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
         faces = []
         height, width = frame.shape[:2]
         
+        # Детектор работает за O(пикселей) - уменьшаем кадр до DETECTION_MAX_WIDTH,
+        # а найденные прямоугольники масштабируем обратно
+        scale = min(1.0, DETECTION_MAX_WIDTH / width)
+        if scale < 1.0:
+            size = (round(width * scale), round(height * scale))
+            frame = cv2.resize(frame, size, dst=self._buffer('small', (size[1], size[0], 3)),
+                               interpolation=cv2.INTER_AREA)
+        inv_scale = 1.0 / scale
+        
         try:
             if self.cnn_detector:
-                # Используем CNN детектор (более точный)
+                # Используем CNN детектор (более точный, использует цвет - нужен RGB)
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB,
+                                         dst=self._buffer('rgb', frame.shape))
                 dets = self.cnn_detector(rgb_frame, 0)
                 
                 for detection in dets:
@@ -176,10 +532,10 @@ class VideoProcessor:
                     if confidence < 0.5:
                         continue
                     
-                    x = rect.left()
-                    y = rect.top()
-                    w = rect.width()
-                    h = rect.height()
+                    x = rect.left() * inv_scale
+                    y = rect.top() * inv_scale
+                    w = rect.width() * inv_scale
+                    h = rect.height() * inv_scale
                     
                     # Добавляем margin вокруг лица
                     margin = 0.15
@@ -191,15 +547,20 @@ class VideoProcessor:
                     faces.append(FaceBoundingBox(x, y, w, h, confidence))
                     
             elif self.detector:
-                # Используем HOG детектор (быстрый)
-                # Второй аргумент - увеличение изображения для поиска (1 = нет увеличения)
-                dets = self.detector(rgb_frame, 1)
+                # Используем HOG детектор (быстрый). HOG строится по градиентам яркости,
+                # цвет ему не нужен - одноканальный кадр втрое меньше по объему
+                gray_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY,
+                                          dst=self._buffer('gray', frame.shape[:2]))
+                # Второй аргумент - число удвоений изображения для поиска мелких лиц.
+                # Одно удвоение уменьшенного кадра сохраняет лица от ~80px при 1280px
+                # ширины и стоит в 4 раза меньше удвоения полного кадра
+                dets = self.detector(gray_frame, 1)
                 
                 for rect in dets:
-                    x = rect.left()
-                    y = rect.top()
-                    w = rect.width()
-                    h = rect.height()
+                    x = rect.left() * inv_scale
+                    y = rect.top() * inv_scale
+                    w = rect.width() * inv_scale
+                    h = rect.height() * inv_scale
                     
                     # Добавляем margin
                     margin = 0.2
@@ -217,7 +578,8 @@ class VideoProcessor:
     
     def process_video(self, input_path: str, output_path: str, 
                      masks_data: Dict, blur_strength: int = 15,
-                     progress_callback: Optional[callable] = None) -> bool:
+                     progress_callback: Optional[callable] = None,
+                     frame_skip: int = 1) -> bool:
         """
         Обрабатывает видео: применяет размытие к обнаруженным лицам
         
@@ -225,8 +587,10 @@ class VideoProcessor:
             input_path: Путь к исходному видео
             output_path: Путь для сохранения обработанного видео
             masks_data: Словарь с масками для размытия {frame_number: [masks]}
-            blur_strength: Сила размытия (радиус Gaussian blur)
+            blur_strength: Сила размытия (сторона блока пикселизации в пикселях)
             progress_callback: Функция для отслеживания прогресса
+            frame_skip: Шаг анализа; пропущенные кадры используют маски
+                ближайшего предыдущего проанализированного кадра
             
         Returns:
             True если обработка завершена успешно
@@ -234,6 +598,13 @@ class VideoProcessor:
         if not os.path.exists(input_path):
             raise FileNotFoundError(f"Input video not found: {input_path}")
         
+        # Размывать нечего - копируем видеопоток без декодирования и кодирования
+        if not any(masks_data.values()) and remux_video(input_path, output_path):
+            if progress_callback:
+                progress_callback(100)
+            logger.info(f"No masks, video stream copied: {output_path}")
+            return True
+        
         cap = cv2.VideoCapture(input_path)
         if not cap.isOpened():
             raise ValueError(f"Cannot open input video: {input_path}")
@@ -244,41 +615,72 @@ class VideoProcessor:
         width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
         height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
         
-        # Создаем VideoWriter для выходного файла
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        if not out.isOpened():
+        # Создаем запись выходного файла (H.264, если доступен PyAV)
+        try:
+            out = open_video_writer(output_path, fps, (width, height))
+        except ValueError:
             cap.release()
-            raise ValueError(f"Cannot create output video: {output_path}")
+            raise
         
         logger.info(f"Processing video: {input_path} -> {output_path}")
         logger.info(f"Blur strength: {blur_strength}, Total frames: {total_frames}")
         
+        # Декодирование и кодирование идут в отдельных потоках (OpenCV отпускает GIL),
+        # этот поток только размывает кадры - время ~ max из трех стадий, а не их сумма
+        read_q = queue.Queue(maxsize=PIPELINE_PREFETCH)
+        write_q = queue.Queue(maxsize=PIPELINE_PREFETCH)
+        stop = threading.Event()
+        # Исключения потоков декодирования и кодирования - пробрасываются после join
+        errors: List[Exception] = []
+        reader = threading.Thread(target=_read_frames, args=(cap, read_q, stop, errors), daemon=True)
+        writer = threading.Thread(target=_write_frames, args=(out, write_q, errors), daemon=True)
+        reader.start()
+        writer.start()
+        
+        try:
+            self._blur_frames(read_q, write_q, masks_data, blur_strength,
+                              total_frames, frame_skip, progress_callback, errors)
+        finally:
+            stop.set()
+            # Освобождаем место в очереди, если читатель ждет его после ошибки
+            while reader.is_alive():
+                try:
+                    read_q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            write_q.put(None)
+            writer.join()
+            cap.release()
+            out.release()
+        
+        if errors:
+            raise errors[0]
+        
+        _drop_page_cache(input_path)
+        _drop_page_cache(output_path)
+        
+        logger.info(f"Video processing complete: {output_path}")
+        return True
+    
+    def _blur_frames(self, read_q: queue.Queue, write_q: queue.Queue, masks_data: Dict,
+                     blur_strength: int, total_frames: int, frame_skip: int,
+                     progress_callback: Optional[callable], errors: List[Exception]):
+        """Стадия размытия конвейера process_video; останавливается при ошибке другой стадии"""
+        offsets, boxes = build_frame_masks(masks_data, total_frames, frame_skip)
+        # Смещения как список int: в цикле сравниваются и индексируются Python-числа,
+        # а не скаляры numpy
+        bounds = offsets.tolist()
+        masked_frames = len(bounds) - 1
         frame_number = 0
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Получаем маски для текущего кадра
-            frame_masks = masks_data.get(str(frame_number), [])
-            
-            if frame_masks:
-                # Преобразуем словари обратно в FaceBoundingBox объекты
-                masks = [
-                    FaceBoundingBox(
-                        x=mask['x'], y=mask['y'], 
-                        width=mask['width'], height=mask['height'],
-                        confidence=mask.get('confidence', 1.0)
-                    ) for mask in frame_masks
-                ]
-                # Применяем размытие
+        while not errors and (frame := read_q.get()) is not None:
+            # Кадры без масок (и сверх CAP_PROP_FRAME_COUNT) сразу идут на запись
+            if frame_number < masked_frames and bounds[frame_number + 1] > bounds[frame_number]:
+                masks = boxes[bounds[frame_number]:bounds[frame_number + 1]]
                 frame = self.apply_blur_to_frame(frame, masks, blur_strength)
             
-            # Записываем обработанный кадр
-            out.write(frame)
+            # Передаем обработанный кадр на запись
+            write_q.put(frame)
             
             # Вызываем callback прогресса
             if progress_callback and frame_number % 10 == 0:
@@ -286,55 +688,95 @@ class VideoProcessor:
                 progress_callback(progress)
             
             frame_number += 1
-        
-        cap.release()
-        out.release()
-        
-        logger.info(f"Video processing complete: {output_path}")
-        return True
     
-    def apply_blur_to_frame(self, frame: np.ndarray, masks: List[FaceBoundingBox], 
+    def apply_blur_to_frame(self, frame: np.ndarray, masks: np.ndarray, 
                            blur_strength: int) -> np.ndarray:
         """
         Применяет размытие к областям с лицами в кадре
         
+        Кадр изменяется на месте: кадры из VideoCapture - собственные буферы,
+        исходное изображение после размытия не используется.
+        
         Args:
-            frame: Исходный кадр
-            masks: Список масок для размытия
+            frame: Исходный кадр (изменяется на месте)
+            masks: Массив int32 формы (N, 4) с прямоугольниками (x1, y1, x2, y2)
             blur_strength: Сила размытия
             
         Returns:
             Кадр с примененным размытием
         """
-        if not masks:
+        if len(masks) == 0:
+            return frame
+        
+        block = max(2, blur_strength)
+        
+        if self.cuda_stream is not None:
+            self._pixelate_cuda(frame, masks, block)
             return frame
         
-        # Создаем копию кадра для модификации
-        result_frame = frame.copy()
+        if NUMBA_AVAILABLE:
+            # JIT-ядро: все прямоугольники за один вызов без Python-цикла по лицам
+            pixelate_boxes(frame, masks, block)
+            return frame
         
-        for mask in masks:
+        height, width = frame.shape[:2]
+        for x1, y1, x2, y2 in masks.tolist():
             # Убеждаемся, что координаты в пределах кадра
-            x1 = max(0, mask.x)
-            y1 = max(0, mask.y)
-            x2 = min(frame.shape[1], mask.x + mask.width)
-            y2 = min(frame.shape[0], mask.y + mask.height)
+            x1 = max(0, x1)
+            y1 = max(0, y1)
+            x2 = min(width, x2)
+            y2 = min(height, y2)
             
             # Извлекаем область интереса (ROI)
-            roi = result_frame[y1:y2, x1:x2]
+            roi = frame[y1:y2, x1:x2]
             
             if roi.size > 0:
-                # Применяем Gaussian blur
-                kernel_size = max(3, blur_strength * 2 + 1)
-                blurred_roi = cv2.GaussianBlur(roi, (kernel_size, kernel_size), 0)
+                # Пикселизация: уменьшаем ROI усреднением (INTER_AREA) и растягиваем
+                # обратно блоками (INTER_NEAREST) - сторона блока равна blur_strength.
+                # INTER_AREA - это box-фильтр по блоку: O(пикселей) при любом blur_strength
+                roi_height, roi_width = roi.shape[:2]
+                small = cv2.resize(roi, (max(1, roi_width // block), max(1, roi_height // block)),
+                                   interpolation=cv2.INTER_AREA)
                 
-                # Вставляем размытую область обратно
-                result_frame[y1:y2, x1:x2] = blurred_roi
+                # Вставляем пикселизированную область обратно
+                frame[y1:y2, x1:x2] = cv2.resize(small, (roi_width, roi_height),
+                                                 interpolation=cv2.INTER_NEAREST)
+        
+        return frame
+    
+    def _pixelate_cuda(self, frame: np.ndarray, masks: np.ndarray, block: int):
+        """
+        Пикселизирует прямоугольники на GPU
         
-        return result_frame
+        Кадр загружается и выгружается один раз на все лица, операции над ROI
+        ставятся в один поток CUDA и выполняются асинхронно.
+        """
+        stream = self.cuda_stream
+        height, width = frame.shape[:2]
+        self._gpu_frame.upload(frame, stream)
+        
+        # Промежуточные уменьшенные ROI живут до завершения потока
+        small_rois = []
+        for x1, y1, x2, y2 in masks.tolist():
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            
+            roi_width, roi_height = x2 - x1, y2 - y1
+            roi = cv2.cuda_GpuMat(self._gpu_frame, (x1, y1, roi_width, roi_height))
+            small = cv2.cuda.resize(roi, (max(1, roi_width // block), max(1, roi_height // block)),
+                                    interpolation=cv2.INTER_AREA, stream=stream)
+            cv2.cuda.resize(small, (roi_width, roi_height), dst=roi,
+                            interpolation=cv2.INTER_NEAREST, stream=stream)
+            small_rois.append(small)
+        
+        self._gpu_frame.download(stream, frame)
+        stream.waitForCompletion()
     
     def generate_preview(self, input_path: str, output_path: str, 
                         masks_data: Dict, blur_strength: int = 15,
-                        preview_duration: int = 10) -> bool:
+                        preview_duration: int = 10, frame_skip: int = 1) -> bool:
         """
         Генерирует короткий предпросмотр обработанного видео
         
@@ -344,6 +786,7 @@ class VideoProcessor:
             masks_data: Словарь с масками
             blur_strength: Сила размытия
             preview_duration: Длительность превью в секундах
+            frame_skip: Шаг анализа (см. process_video)
             
         Returns:
             True если успешно
@@ -364,26 +807,25 @@ class VideoProcessor:
         preview_width = min(640, width)
         preview_height = int(preview_width * height / width)
         
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (preview_width, preview_height))
+        try:
+            out = open_video_writer(output_path, fps, (preview_width, preview_height))
+        except ValueError:
+            cap.release()
+            raise
         
         logger.info(f"Generating preview: {preview_duration}s, {preview_frames} frames")
         
+        offsets, boxes = build_frame_masks(masks_data, preview_frames, frame_skip)
+        bounds = offsets.tolist()
+        
         for frame_num in range(preview_frames):
             ret, frame = cap.read()
             if not ret:
                 break
             
             # Получаем маски для текущего кадра
-            frame_masks = masks_data.get(str(frame_num), [])
-            
-            if frame_masks:
-                masks = [
-                    FaceBoundingBox(
-                        x=mask['x'], y=mask['y'], 
-                        width=mask['width'], height=mask['height']
-                    ) for mask in frame_masks
-                ]
+            if bounds[frame_num + 1] > bounds[frame_num]:
+                masks = boxes[bounds[frame_num]:bounds[frame_num + 1]]
                 frame = self.apply_blur_to_frame(frame, masks, blur_strength)
             
             # Изменяем размер для превью
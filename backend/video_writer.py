@@ -0,0 +1,148 @@
+# video_writer.py
+# Запись видео: H.264 через PyAV (аппаратный кодировщик, если доступен), иначе cv2 mp4v
+import cv2
+import numpy as np
+import logging
+from fractions import Fraction
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Кодировщики H.264 в порядке предпочтения: аппаратные, затем программный libx264
+H264_ENCODERS = ('h264_nvenc', 'h264_qsv', 'h264_videotoolbox', 'libx264')
+# libx264 настроен на скорость: кодирование стоит на критическом пути обработки
+LIBX264_OPTIONS = {'preset': 'ultrafast', 'crf': '23'}
+
+# Выбранный в этом процессе кодировщик ('' - ни один не открылся)
+_h264_encoder: Optional[str] = None
+
+def _codec_options(encoder: str) -> dict:
+    return LIBX264_OPTIONS if encoder == 'libx264' else {}
+
+def _select_h264_encoder(av) -> str:
+    """Находит первый кодировщик H.264, который открывается на этой машине"""
+    global _h264_encoder
+    if _h264_encoder is not None:
+        return _h264_encoder
+
+    _h264_encoder = ''
+    for encoder in H264_ENCODERS:
+        if encoder not in av.codecs_available:
+            continue
+        try:
+            # Пробное открытие: аппаратный кодировщик может быть собран, но без устройства
+            codec = av.CodecContext.create(encoder, 'w')
+            codec.width, codec.height = 64, 64
+            codec.pix_fmt = 'yuv420p'
+            codec.time_base = Fraction(1, 25)
+            codec.options = _codec_options(encoder)
+            codec.open()
+        except av.FFmpegError:
+            continue
+        _h264_encoder = encoder
+        break
+
+    logger.info(f"H.264 encoder: {_h264_encoder or 'not available'}")
+    return _h264_encoder
+
+class PyAVVideoWriter:
+    """Запись кадров BGR в H.264 (yuv420p) через PyAV"""
+
+    def __init__(self, output_path: str, fps: float, size: Tuple[int, int], encoder: str):
+        import av
+        self.av = av
+        self.container = av.open(output_path, 'w')
+        try:
+            self.stream = self.container.add_stream(
+                encoder, rate=Fraction(fps).limit_denominator(1001), options=_codec_options(encoder))
+            self.stream.width, self.stream.height = size
+            self.stream.pix_fmt = 'yuv420p'
+        except Exception:
+            self.container.close()
+            raise
+
+    def write(self, frame: np.ndarray):
+        """Кодирует кадр BGR (преобразование в yuv420p выполняет libswscale)"""
+        video_frame = self.av.VideoFrame.from_ndarray(frame, format='bgr24')
+        self.container.mux(self.stream.encode(video_frame))
+
+    def release(self):
+        """Сбрасывает буферы кодировщика и закрывает файл"""
+        try:
+            self.container.mux(self.stream.encode(None))
+        finally:
+            self.container.close()
+
+class OpenCVVideoWriter:
+    """Запись через cv2.VideoWriter (MPEG-4 Part 2, mp4v)"""
+
+    def __init__(self, output_path: str, fps: float, size: Tuple[int, int]):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.out = cv2.VideoWriter(output_path, fourcc, fps, size)
+        if not self.out.isOpened():
+            raise ValueError(f"Cannot create output video: {output_path}")
+
+    def write(self, frame: np.ndarray):
+        self.out.write(frame)
+
+    def release(self):
+        self.out.release()
+
+def remux_video(input_path: str, output_path: str) -> bool:
+    """
+    Копирует видеопоток в MP4 без декодирования и кодирования (stream copy)
+
+    Returns:
+        False, если PyAV не установлен или кодек нельзя поместить в MP4
+    """
+    try:
+        import av
+    except ImportError:
+        return False
+
+    try:
+        with av.open(input_path) as source, av.open(output_path, 'w', format='mp4') as target:
+            in_stream = source.streams.video[0]
+            out_stream = target.add_stream_from_template(in_stream)
+            for packet in source.demux(in_stream):
+                # Пакеты сброса демультиплексора данных не несут
+                if packet.dts is None:
+                    continue
+                packet.stream = out_stream
+                target.mux(packet)
+    except (av.FFmpegError, IndexError, ValueError) as e:
+        logger.warning(f"Stream copy failed, re-encoding instead: {e}")
+        return False
+
+    return True
+
+def open_video_writer(output_path: str, fps: float, size: Tuple[int, int]):
+    """
+    Открывает запись видео с интерфейсом cv2.VideoWriter (write/release)
+
+    H.264 через PyAV, если он установлен и нашелся рабочий кодировщик,
+    иначе cv2.VideoWriter с mp4v.
+
+    Args:
+        output_path: Путь к выходному файлу
+        fps: Частота кадров
+        size: (ширина, высота) кадра
+
+    Raises:
+        ValueError: Если файл не удалось открыть на запись
+    """
+    width, height = size
+    try:
+        import av
+    except ImportError:
+        logger.warning("PyAV not available, using mp4v. Please install: pip install av")
+    else:
+        encoder = _select_h264_encoder(av)
+        # yuv420p требует четных размеров кадра
+        if encoder and width % 2 == 0 and height % 2 == 0:
+            try:
+                return PyAVVideoWriter(output_path, fps, size, encoder)
+            except av.FFmpegError as e:
+                logger.warning(f"Cannot open {encoder} writer, using mp4v: {e}")
+
+    return OpenCVVideoWriter(output_path, fps, size)
@@ -0,0 +1,44 @@
+# worker_tasks.py
+# Функции, выполняемые в процессах ProcessPoolExecutor
+from typing import Dict, Optional
+
+from video_processor import VideoProcessor
+
+# Детектор создается один раз на процесс в init_worker
+_processor: Optional[VideoProcessor] = None
+
+def init_worker(cuda_slot=None):
+    """
+    Инициализирует процесс пула: создает и прогревает VideoProcessor
+
+    cuda_slot - общий multiprocessing.Value: GPU получает только первый процесс,
+    который его заберет, остальные пикселизируют на CPU (контекст CUDA в каждом
+    процессе пула занял бы видеопамять за каждое ядро)
+    """
+    global _processor
+    use_cuda = False
+    if cuda_slot is not None:
+        with cuda_slot.get_lock():
+            use_cuda, cuda_slot.value = bool(cuda_slot.value), 0
+    
+    _processor = VideoProcessor(use_cuda=use_cuda)
+    _processor.warmup()
+
+def start_worker():
+    """Пустая задача: заставляет пул запустить процесс (и init_worker) заранее"""
+
+def run_analysis_range(video_path: str, start: int, stop: Optional[int], frame_skip: int,
+                       track: bool = False) -> Dict:
+    """Анализирует диапазон кадров видео в процессе пула"""
+    return _processor.analyze_frame_range(video_path, start, stop, frame_skip, track)
+
+def run_processing(video_id: str, progress_queue, **kwargs) -> bool:
+    """Обрабатывает видео в процессе пула, передавая прогресс через очередь"""
+    def progress_callback(percent):
+        progress_queue.put((video_id, percent))
+
+    return _processor.process_video(progress_callback=progress_callback, **kwargs)
+
+def run_preview(**kwargs) -> bool:
+    """Генерирует превью в процессе пула"""
+    return _processor.generate_preview(**kwargs)
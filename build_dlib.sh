@@ -0,0 +1,60 @@
+#!/usr/bin/env bash
+# build_dlib.sh
+# Сборка dlib из исходников с SIMD (AVX2/FMA на x86_64, NEON на ARM) и PGO
+#
+# Использование: ./build_dlib.sh path/to/sample_video.mp4
+# Видео нужно для профилирующего прогона: на нем собирается профиль HOG-детектора,
+# по которому выполняется финальная сборка (-fprofile-use).
+set -euo pipefail
+
+SAMPLE_VIDEO="${1:?Usage: $0 path/to/sample_video.mp4}"
+# Профилирующий прогон выполняется из backend/ - путь нужен абсолютный
+[ -f "$SAMPLE_VIDEO" ] || { echo "Sample video not found: $SAMPLE_VIDEO" >&2; exit 1; }
+SAMPLE_VIDEO="$(realpath "$SAMPLE_VIDEO")"
+DLIB_VERSION="${DLIB_VERSION:-20.0.0}"
+ROOT_DIR="$(cd "$(dirname "$0")" && pwd)"
+BUILD_DIR="$(mktemp -d)"
+PROFILE_DIR="$BUILD_DIR/profile"
+trap 'rm -rf "$BUILD_DIR"' EXIT
+
+case "$(uname -m)" in
+    x86_64)
+        SIMD_OPTIONS=(--set USE_AVX_INSTRUCTIONS=1)
+        SIMD_FLAGS="-mavx2 -mfma"
+        ;;
+    aarch64|arm64)
+        SIMD_OPTIONS=(--set USE_NEON_INSTRUCTIONS=1)
+        SIMD_FLAGS=""
+        ;;
+    *)
+        SIMD_OPTIONS=()
+        SIMD_FLAGS=""
+        ;;
+esac
+
+# Исходники dlib
+pip download --no-deps --no-binary :all: "dlib==$DLIB_VERSION" -d "$BUILD_DIR"
+tar -xzf "$BUILD_DIR/dlib-$DLIB_VERSION.tar.gz" -C "$BUILD_DIR"
+cd "$BUILD_DIR/dlib-$DLIB_VERSION"
+
+build() {
+    rm -rf build
+    pip uninstall -y dlib >/dev/null 2>&1 || true
+    python setup.py install "${SIMD_OPTIONS[@]}" --compiler-flags "-O3 $SIMD_FLAGS $1"
+}
+
+# 1. Инструментированная сборка и профилирующий прогон на полном анализе видео
+build "-fprofile-generate=$PROFILE_DIR"
+(cd "$ROOT_DIR/backend" && python -c "
+import sys
+from video_processor import VideoProcessor
+VideoProcessor().analyze_video(sys.argv[1], frame_skip=1)
+" "$SAMPLE_VIDEO")
+
+# 2. Финальная сборка по собранному профилю
+build "-fprofile-use=$PROFILE_DIR -fprofile-correction"
+
+python -c "
+import dlib
+print('dlib', dlib.__version__, 'AVX:', dlib.USE_AVX_INSTRUCTIONS, 'NEON:', dlib.USE_NEON_INSTRUCTIONS)
+"
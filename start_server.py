@@ -11,13 +11,16 @@ if __name__ == "__main__":
     print("📁 Static files: ./static")
     print("🌐 Server: http://localhost:8000")
     print("📚 API Docs: http://localhost:8000/docs")
-    print("🔄 Auto-reload: Enabled")
+    # Авто-перезагрузка только для разработки: каждый перезапуск заново
+    # создает пул процессов и прогревает детекторы
+    reload = os.environ.get("RELOAD") == "1"
+    print(f"🔄 Auto-reload: {'Enabled' if reload else 'Disabled (set RELOAD=1 to enable)'}")
     
     # Используем import string для включения reload
     uvicorn.run(
         "backend.main:app",  # Импорт как строка
         host="localhost",
         port=8000,
-        reload=True,  # Теперь будет работать
+        reload=reload,
         log_level="info"
     )
\ No newline at end of file